@@ -10,15 +10,21 @@ Usage:
 
 import asyncio
 import sys
-import os
 import argparse
+import io
 import subprocess
-import tempfile
 import shutil
+import wave
+from collections import deque
 from pathlib import Path
+from typing import Iterator
 from datetime import datetime
 from dotenv import load_dotenv
 
+import av
+import numpy as np
+import soundfile as sf
+from scipy import signal
 from google import genai
 from google.genai import types
 
@@ -27,15 +33,44 @@ load_dotenv()
 # Model for audio transcription
 TRANSCRIBE_MODEL = "gemini-3-pro-preview"
 
+# Multilingual transcription instruction - accuracy focused.
+# Sent as a static system instruction so the request prefix is identical across runs.
+TRANSCRIBE_INSTRUCTION = """You are a professional transcriber. Transcribe the audio with maximum accuracy.
+
+Instructions:
+- Detect and transcribe all languages spoken (English, Korean, French).
+- Use native scripts: Korean in Hangul (proper 띄어쓰기), French with diacritics (é, è, ç).
+- Handle non-native accents - infer intended words from context.
+- Spell technical/academic terms correctly.
+- If a word is genuinely unclear, mark [unclear].
+- Remove excessive filler words (um, uh, 어, 음).
+- Separate speakers if distinguishable.
+
+Output the transcript in clean, readable Markdown."""
+
 # Supported audio formats
 SUPPORTED_FORMATS = {'.mp3', '.wav', '.m4a', '.flac', '.ogg', '.webm'}
 
+# Preprocessing: 16kHz mono (optimal for ASR), voice band 200Hz - 3kHz
+TARGET_SAMPLE_RATE = 16000
+VOICE_BAND_SOS = signal.butter(4, [200, 3000], btype="bandpass", fs=TARGET_SAMPLE_RATE, output="sos")
+TARGET_RMS = 0.1              # ~-20 dBFS loudness normalization
+
 
 def check_ffmpeg_available() -> bool:
     """Check if ffmpeg is installed and available in PATH"""
     return shutil.which('ffmpeg') is not None
 
 
+def check_ffmpeg_soxr() -> bool:
+    """Check if ffmpeg was built with the SoX resampler (libsoxr)"""
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-buildconf'], capture_output=True, text=True)
+        return '--enable-libsoxr' in result.stdout
+    except OSError:
+        return False
+
+
 def get_mime_type(file_path: Path) -> str:
     """Get MIME type based on file extension"""
     mime_types = {
@@ -49,41 +84,112 @@ def get_mime_type(file_path: Path) -> str:
     return mime_types.get(file_path.suffix.lower(), 'audio/mpeg')
 
 
-def preprocess_audio(input_path: Path) -> Path:
+def decode_audio(input_path: Path) -> Iterator[np.ndarray]:
+    """Decode audio file to mono float32 blocks at 16kHz, one block per decoded frame"""
+    with av.open(str(input_path)) as container:
+        stream = container.streams.audio[0]
+        # Downmix and resample while decoding, so full-rate audio is never held in memory
+        resampler = av.AudioResampler(format="fltp", layout="mono", rate=TARGET_SAMPLE_RATE)
+        for frame in container.decode(stream):
+            for out in resampler.resample(frame):
+                yield out.to_ndarray()[0]
+        for out in resampler.resample(None):
+            yield out.to_ndarray()[0]
+
+
+def process_in_memory(input_path: Path) -> io.BytesIO:
+    """Decode, band-pass and normalize audio in-process to a WAV buffer, block by block"""
+    # Band-pass each block as it is decoded, carrying the filter state across blocks
+    zi = np.zeros((VOICE_BAND_SOS.shape[0], 2))
+    blocks = deque()
+    sum_squares = 0.0
+    num_samples = 0
+    for block in decode_audio(input_path):
+        filtered, zi = signal.sosfilt(VOICE_BAND_SOS, block, zi=zi)
+        sum_squares += np.dot(filtered, filtered)
+        num_samples += len(filtered)
+        blocks.append(filtered.astype(np.float32))
+    if not num_samples:
+        raise ValueError("no audio samples decoded")
+    
+    rms = np.sqrt(sum_squares / num_samples)
+    gain = TARGET_RMS / rms if rms > 0 else 1.0
+    
+    # Scale in place and write each block out as 16-bit PCM, releasing it as we go
+    buffer = io.BytesIO()
+    with sf.SoundFile(buffer, "w", samplerate=TARGET_SAMPLE_RATE, channels=1,
+                      format="WAV", subtype="PCM_16") as wav:
+        while blocks:
+            block = blocks.popleft()
+            block *= gain
+            np.clip(block, -1.0, 1.0, out=block)
+            wav.write(block)
+    buffer.seek(0)
+    return buffer
+
+
+def pcm_to_wav(pcm: bytes) -> io.BytesIO:
+    """Wrap raw 16kHz mono s16le PCM in an in-memory WAV container"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(TARGET_SAMPLE_RATE)
+        wav.writeframes(pcm)
+    buffer.seek(0)
+    return buffer
+
+
+async def preprocess_with_ffmpeg(input_path: Path) -> io.BytesIO | Path:
     """
     Preprocess audio using ffmpeg to reduce noise and normalize volume.
-    Returns path to temporary processed wav file.
+    Streams PCM from ffmpeg's stdout into memory (no temp file).
+    Returns a WAV buffer, or the original path on failure.
     """
     if not check_ffmpeg_available():
         print("Warning: ffmpeg not found. Skipping preprocessing.")
         return input_path
 
-    print("Preprocessing audio (Noise Reduction & Normalization)...")
-    
-    # Create temp file
-    temp_dir = Path(tempfile.gettempdir())
-    output_path = temp_dir / f"processed_{input_path.stem}_{int(datetime.now().timestamp())}.wav"
-    
-    # FFmpeg command:
+    # FFmpeg filtergraph (single fused pass):
+    # - aformat mono: Downmix first so the filters process one channel
+    # - aresample: Resample to 16kHz (optimal for ASR), SoXR when available
     # - highpass=f=200: Remove low frequency rumble
     # - lowpass=f=3000: Keep human voice range
-    # - loudnorm: Normalize loudness
-    # - ar 16000: Resample to 16kHz (optimal for ASR)
-    # - ac 1: Convert to mono
+    # - dynaudnorm: Normalize loudness (much cheaper than loudnorm's look-ahead)
+    resampler = 'aresample=16000:resampler=soxr:precision=20' if check_ffmpeg_soxr() else 'aresample=16000'
+    filters = (
+        f'aformat=channel_layouts=mono,{resampler},highpass=f=200,lowpass=f=3000,dynaudnorm=f=200:g=15,'
+        'aformat=sample_fmts=s16:sample_rates=16000:channel_layouts=mono'
+    )
     cmd = [
-        'ffmpeg', '-y', '-i', str(input_path),
-        '-af', 'highpass=f=200,lowpass=f=3000,loudnorm',
-        '-ar', '16000', '-ac', '1',
-        str(output_path)
+        'ffmpeg', '-nostdin', '-i', str(input_path),
+        '-af', filters,
+        '-f', 's16le', 'pipe:1'
     ]
     
-    try:
-        subprocess.run(cmd, check=True, capture_output=True)
-        return output_path
-    except subprocess.CalledProcessError as e:
-        print(f"Error during preprocessing: {e}")
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    pcm, _ = await proc.communicate()
+    if proc.returncode != 0:
+        print(f"Error during preprocessing: ffmpeg exited with {proc.returncode}")
         print("Falling back to original file.")
         return input_path
+    return pcm_to_wav(pcm)
+
+
+async def preprocess_audio(input_path: Path) -> io.BytesIO | Path:
+    """
+    Reduce noise and normalize volume, converting to 16kHz mono WAV.
+    Processes in memory, falling back to ffmpeg if decoding fails.
+    Returns a WAV buffer, or the original path if preprocessing is unavailable.
+    """
+    print("Preprocessing audio (Noise Reduction & Normalization)...")
+    try:
+        return await asyncio.to_thread(process_in_memory, input_path)
+    except Exception as e:
+        print(f"In-process preprocessing failed ({e}), trying ffmpeg...")
+        return await preprocess_with_ffmpeg(input_path)
 
 
 async def transcribe_audio(file_path: Path, output_path: Path = None) -> str:
@@ -100,8 +206,8 @@ async def transcribe_audio(file_path: Path, output_path: Path = None) -> str:
     print(f"Transcribing: {file_path.name}")
     print(f"File size: {file_path.stat().st_size / (1024*1024):.1f} MB")
     
-    processed_path = preprocess_audio(file_path)
-    is_processed = processed_path != file_path
+    processed = await preprocess_audio(file_path)
+    is_processed = processed is not file_path
     
     print("-" * 40)
     
@@ -111,31 +217,18 @@ async def transcribe_audio(file_path: Path, output_path: Path = None) -> str:
     try:
         # Upload file using File API
         print("Uploading to Gemini...")
-        file_ref = await client.aio.files.upload(file=processed_path)
+        mime_type = "audio/wav" if is_processed else get_mime_type(file_path)
+        file_ref = await client.aio.files.upload(
+            file=processed, config=types.UploadFileConfig(mime_type=mime_type)
+        )
         print(f"Uploaded: {file_ref.name}")
         
-        # Multilingual transcription prompt - accuracy focused
-        prompt = """You are a professional transcriber. Transcribe the audio with maximum accuracy.
-
-Instructions:
-- Detect and transcribe all languages spoken (English, Korean, French).
-- Use native scripts: Korean in Hangul (proper 띄어쓰기), French with diacritics (é, è, ç).
-- Handle non-native accents - infer intended words from context.
-- Spell technical/academic terms correctly.
-- If a word is genuinely unclear, mark [unclear].
-- Remove excessive filler words (um, uh, 어, 음).
-- Separate speakers if distinguishable.
-
-Output the transcript in clean, readable Markdown."""
-
         print("Generating transcript...")
         response = await client.aio.models.generate_content(
             model=TRANSCRIBE_MODEL,
-            contents=[
-                file_ref,
-                prompt
-            ],
+            contents=[file_ref],
             config=types.GenerateContentConfig(
+                system_instruction=TRANSCRIBE_INSTRUCTION,
                 thinking_config=types.ThinkingConfig(thinking_level="low")
             )
         )
@@ -173,13 +266,6 @@ Output the transcript in clean, readable Markdown."""
             except Exception as e:
                 print(f"Warning: Failed to delete Gemini file: {e}")
 
-        # Cleanup temp local file
-        if is_processed and processed_path.exists():
-            try:
-                os.remove(processed_path)
-            except OSError:
-                pass
-
 
 async def main():
     parser = argparse.ArgumentParser(
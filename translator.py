@@ -1,11 +1,17 @@
 import asyncio
+import atexit
 import sys
 import os
 import json
-import time
+import re
+import string
+import threading
+from collections import OrderedDict, deque
 from datetime import datetime
+from typing import NamedTuple
 from dotenv import load_dotenv
 
+import numpy as np
 import pyaudio
 from google import genai
 from google.genai import types
@@ -15,17 +21,36 @@ load_dotenv()
 # Audio configuration
 INPUT_SAMPLE_RATE = 16000
 CHUNK_SIZE = 1024
+SEND_MAX_CHUNKS = 8           # Max pending chunks coalesced into one blob (~0.5 s)
+AUDIO_BACKLOG_SEC = 2.0       # Captured audio kept while no session is sending
+AUDIO_MIME = f"audio/pcm;rate={INPUT_SAMPLE_RATE}"
+
+# Client-side silence skipping (saves bandwidth; the Live API runs its own VAD)
+SKIP_SILENCE = False
+SILENCE_RMS = 200             # int16 RMS below which a chunk counts as silence
+SILENCE_HANGOVER_SEC = 0.3    # Keep sending this long after speech stops
+SILENCE_PREROLL_CHUNKS = 2    # Silent chunks sent ahead of resumed speech
 
 # Translation settings
 CHUNK_DURATION_SEC = 10       # Time buffer before translation
 MIN_CHUNK_LENGTH = 5         # Skip short chunks
+MIN_CHUNK_WORDS = 2           # Skip one-word chunks in space-delimited languages
 SENTENCE_FLUSH_MIN = 1.0      # Min wait before sentence-end flush
 SESSION_TIMEOUT = 840         # Auto-reconnect at 14 min
+TRANSLATION_CACHE_SIZE = 4096 # Exact-match translation cache entries
+HISTORY_FLUSH_SEC = 0.5       # Batch window for JSONL history writes
+CONTEXT_PAIRS = 5             # Previous pairs included as translation context
+TRANSLATE_CONCURRENCY = 4     # Max in-flight translation requests
+TRANSLATE_BATCH_MAX = 8       # Max queued transcripts per translation request
+TRANSLATION_DRAIN_SEC = 3.0   # Max wait for pending translations when a session ends
 
 # Models
 LIVE_MODEL = "gemini-2.5-flash-native-audio-preview-12-2025"
 TRANSLATE_MODEL = "gemini-2.5-flash-lite"
+SHORT_TRANSLATE_MODEL = "gemini-2.0-flash-lite"  # Cheaper tier for short utterances
+SHORT_TEXT_MAX_CHARS = 20
 HISTORY_DIR = "history"
+TRANSLATION_CACHE_FILE = os.path.join(HISTORY_DIR, "trans_cache.json")
 
 # Supported languages
 LANGUAGES = {
@@ -35,18 +60,69 @@ LANGUAGES = {
     "fr": {"name": "French", "instruction": "Transcrivez UNIQUEMENT le discours en français. Ignorez complètement tout audio non français."},
 }
 
+# Translation instructions, filled in once per session with the language names
+TRANSLATE_INSTRUCTION = """This is real-time speech transcription. Translate the text after "Text:" from {source} to natural {target}.
+Consider the previous translations, if given, for consistent terminology and natural flow, but do not translate them.
+Output ONLY the {target} translation, nothing else."""
+BATCH_TRANSLATE_INSTRUCTION = """This is real-time speech transcription. Translate the text of each item after "Items:" from {source} to natural {target}.
+Items are consecutive parts of the same speech. Consider the previous translations, if given, for consistent terminology and natural flow, but do not translate them.
+Return one {target} translation per item id."""
+
+# Structured output for batched translation: [{"id": int, "translation": str}]
+BATCH_RESPONSE_SCHEMA = types.Schema(
+    type=types.Type.ARRAY,
+    items=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "id": types.Schema(type=types.Type.INTEGER),
+            "translation": types.Schema(type=types.Type.STRING),
+        },
+        required=["id", "translation"],
+    ),
+)
+
+# Queue sentinel that tells a consumer task to finish
+SHUTDOWN = object()
+
+# Compact JSON encoder for history lines and batch prompts (built once, not per call)
+_json_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
 # Sentence ending punctuation
 SENTENCE_ENDERS = {'.', '!', '?', '。', '！', '？'}
 
+# Fixed phrases translated without an API call (keys are normalized)
+PHRASE_TRANSLATIONS = {
+    "en": {"yes": "네", "okay": "네", "thank you": "감사합니다", "thank you very much": "정말 감사합니다",
+           "thanks": "고마워요", "hello": "안녕하세요", "good morning": "좋은 아침입니다"},
+    "ja": {"はい": "네", "ありがとう": "고마워요", "ありがとうございます": "감사합니다",
+           "こんにちは": "안녕하세요", "おはようございます": "좋은 아침입니다"},
+    "ko": {"네": "Yes", "감사합니다": "Thank you", "고맙습니다": "Thank you", "안녕하세요": "Hello",
+           "좋은 아침입니다": "Good morning"},
+    "fr": {"oui": "네", "merci": "감사합니다", "merci beaucoup": "정말 감사합니다",
+           "bonjour": "안녕하세요", "d'accord": "네"},
+}
+PHRASE_PUNCTUATION = "".join(SENTENCE_ENDERS) + ",、 "
+
+
+_pyaudio = None
+
+
+def get_pyaudio() -> pyaudio.PyAudio:
+    """Shared PyAudio instance; PortAudio is initialized once per process"""
+    global _pyaudio
+    if _pyaudio is None:
+        _pyaudio = pyaudio.PyAudio()
+        atexit.register(_pyaudio.terminate)
+    return _pyaudio
+
 
 def list_input_devices():
-    p = pyaudio.PyAudio()
+    p = get_pyaudio()
     devices = []
     for i in range(p.get_device_count()):
         info = p.get_device_info_by_index(i)
         if info["maxInputChannels"] > 0:
             devices.append((i, info["name"]))
-    p.terminate()
     return devices
 
 
@@ -82,19 +158,129 @@ def select_language():
             pass
 
 
+async def run_prompt(func, *args):
+    """Run a blocking console prompt in a daemon thread.
+    
+    Unlike asyncio.to_thread, Ctrl+C can exit while input() is still waiting,
+    since asyncio.run does not join daemon threads on shutdown.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    
+    def resolve(setter, value):
+        if not future.done():  # Cancelled if the user interrupted
+            setter(value)
+    
+    def worker():
+        try:
+            result = func(*args)
+        except BaseException as e:
+            loop.call_soon_threadsafe(resolve, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(resolve, future.set_result, result)
+    
+    threading.Thread(target=worker, daemon=True).start()
+    return await future
+
+
 def ends_with_sentence(text: str) -> bool:
     """Check if text ends with a sentence-ending punctuation"""
-    text = text.rstrip()
-    return len(text) > 0 and text[-1] in SENTENCE_ENDERS
+    # Scan back over trailing whitespace instead of allocating rstrip()
+    i = len(text) - 1
+    while i >= 0 and text[i].isspace():
+        i -= 1
+    return i >= 0 and text[i] in SENTENCE_ENDERS
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text for cache lookup (case and whitespace insensitive)"""
+    return " ".join(text.lower().split())
 
 
 class TranslatorSession:
-    def __init__(self):
+    def __init__(self, source_lang: str):
+        # Translation direction is fixed for the whole session
+        self.source_lang = source_lang
+        self.source_name, self.target_name = translation_direction(source_lang)
+        # Request configs are identical for every call, so build them once
+        names = {"source": self.source_name, "target": self.target_name}
+        self.translate_config = types.GenerateContentConfig(
+            system_instruction=TRANSLATE_INSTRUCTION.format(**names)
+        )
+        self.batch_config = types.GenerateContentConfig(
+            system_instruction=BATCH_TRANSLATE_INSTRUCTION.format(**names),
+            response_mime_type="application/json",
+            response_schema=BATCH_RESPONSE_SCHEMA,
+        )
         self.session_id = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        self.pairs = []
         self.chunk_count = 0
+        self.resume_handle = None  # Latest Live API resumption handle, kept across reconnects
+        self._context_lines = deque(maxlen=CONTEXT_PAIRS)
+        self.context_str = ""  # Prompt context block, updated per pair
         os.makedirs(HISTORY_DIR, exist_ok=True)
+        self.translation_cache = self._load_translation_cache()  # Survives reconnects and restarts
         self.filepath = os.path.join(HISTORY_DIR, f"session_{self.session_id}.jsonl")
+        self._file = open(self.filepath, "a", encoding="utf-8")
+        self._pending_lines = []
+        self._has_pending = asyncio.Event()
+        self._closing = False
+        self._writer_task = None
+    
+    def start(self):
+        """Start the background history writer (call from the event loop)"""
+        self._writer_task = asyncio.create_task(self._writer())
+    
+    async def _writer(self):
+        """Append queued JSONL lines in batches, off the event loop"""
+        while True:
+            await self._has_pending.wait()
+            if not self._closing:
+                await asyncio.sleep(HISTORY_FLUSH_SEC)  # Collect a batch
+            self._has_pending.clear()
+            lines, self._pending_lines = self._pending_lines, []
+            if lines:
+                await asyncio.to_thread(self._write_lines, lines)
+            if self._closing and not self._pending_lines:
+                return
+    
+    def _write_lines(self, lines: list):
+        self._file.writelines(lines)
+        self._file.flush()
+    
+    async def close(self):
+        """Write pending history, close the file and persist the translation cache"""
+        self._closing = True
+        try:
+            if self._writer_task and not self._writer_task.done():
+                self._has_pending.set()
+                await self._writer_task
+            if self._pending_lines:
+                self._write_lines(self._pending_lines)
+                self._pending_lines = []
+        finally:
+            self._file.close()
+            self._save_translation_cache()
+    
+    @staticmethod
+    def _load_translation_cache() -> OrderedDict:
+        """Load translations cached by previous runs (oldest first)"""
+        try:
+            with open(TRANSLATION_CACHE_FILE, encoding="utf-8") as f:
+                entries = json.load(f)
+            return OrderedDict(
+                ((lang, text), translation) for lang, text, translation in entries[-TRANSLATION_CACHE_SIZE:]
+                if translation  # Skip empty results saved by older versions
+            )
+        except (OSError, ValueError, TypeError):
+            return OrderedDict()
+    
+    def _save_translation_cache(self):
+        entries = [[lang, text, translation] for (lang, text), translation in self.translation_cache.items()]
+        try:
+            with open(TRANSLATION_CACHE_FILE, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+        except OSError as e:
+            print(f"[Failed to save translation cache: {e}]")
         
     def add_pair(self, input_text: str, output_text: str):
         if input_text.strip() and output_text.strip():
@@ -105,44 +291,71 @@ class TranslatorSession:
                 "input": input_text.strip(),
                 "output": output_text.strip()
             }
-            self.pairs.append(pair)
-            # Incremental save (append to JSONL)
-            with open(self.filepath, "a", encoding="utf-8") as f:
-                f.write(json.dumps(pair, ensure_ascii=False) + "\n")
+            self._context_lines.append(f"- {pair['input']} -> {pair['output']}\n")
+            self.context_str = f"Previous translations for context:\n{''.join(self._context_lines)}\n"
+            # Incremental save (queued for the JSONL writer)
+            self._pending_lines.append(_json_encode(pair) + "\n")
+            self._has_pending.set()
             return True
         return False
     
-    def get_context(self, n=3):
-        """Get last n pairs for translation context"""
-        return self.pairs[-n:] if self.pairs else []
+    def get_cached_translation(self, text: str):
+        """Look up a previous translation of the same text (LRU)"""
+        key = (self.source_lang, normalize_text(text))
+        translation = self.translation_cache.get(key)
+        if translation is not None:
+            self.translation_cache.move_to_end(key)
+        return translation
+    
+    def cache_translation(self, text: str, translation: str):
+        """Store a translation, evicting the least recently used entry"""
+        self.translation_cache[(self.source_lang, normalize_text(text))] = translation
+        if len(self.translation_cache) > TRANSLATION_CACHE_SIZE:
+            self.translation_cache.popitem(last=False)
 
 
-def is_korean(text: str) -> bool:
-    """Check if text contains mostly Korean characters"""
-    korean_count = sum(1 for c in text if '\uac00' <= c <= '\ud7af' or '\u1100' <= c <= '\u11ff')
-    non_space = len(text.replace(" ", ""))
-    return non_space > 0 and (korean_count / non_space) > 0.3
+# Character classes for language detection, built once at import.
+# Each class maps to a control-character marker for str.translate().
+_FRENCH, _ASCII_ALPHA = "\x01", "\x02"
+FRENCH_CHARS = 'àâäéèêëïîôùûüçœæÀÂÄÉÈÊËÏÎÔÙÛÜÇŒÆ'
 
 
-def is_japanese(text: str) -> bool:
-    """Check if text contains Japanese characters (hiragana, katakana, kanji)"""
-    jp_count = sum(1 for c in text if 
-        '\u3040' <= c <= '\u309f' or  # Hiragana
-        '\u30a0' <= c <= '\u30ff' or  # Katakana
-        '\u4e00' <= c <= '\u9fff')    # CJK (Kanji)
-    non_space = len(text.replace(" ", ""))
-    return non_space > 0 and (jp_count / non_space) > 0.3
+def _build_category_table() -> dict:
+    table = dict.fromkeys(map(ord, FRENCH_CHARS), _FRENCH)
+    table.update(dict.fromkeys(map(ord, string.ascii_letters), _ASCII_ALPHA))
+    # Drop any markers already present in the input so they are not counted
+    table.update(dict.fromkeys(map(ord, _FRENCH + _ASCII_ALPHA)))
+    return table
 
 
-def is_french(text: str) -> bool:
-    """Check if text contains French characters (Latin with accents)"""
-    # French-specific accented characters
-    french_chars = set('àâäéèêëïîôùûüçœæÀÂÄÉÈÊËÏÎÔÙÛÜÇŒÆ')
-    french_count = sum(1 for c in text if c in french_chars)
-    ascii_alpha = sum(1 for c in text if c.isascii() and c.isalpha())
-    non_space = len(text.replace(" ", ""))
-    # French: has Latin letters AND either has French accents OR is mostly ASCII
-    return non_space > 0 and (ascii_alpha / non_space) > 0.5 and (french_count > 0 or ascii_alpha > 0)
+_CATEGORY_TABLE = _build_category_table()
+# Non-Latin source scripts, matched as runs of consecutive characters
+SCRIPT_RE = {
+    "ko": re.compile("[\uac00-\ud7af\u1100-\u11ff]+"),  # Hangul syllables + Jamo
+    "ja": re.compile("[\u3040-\u30ff\u4e00-\u9fff]+"),  # Hiragana, Katakana, Kanji
+}
+# Every byte except ASCII letters, deleted to count letters in ASCII text
+_ASCII_NON_LETTERS = bytes(sorted(set(range(256)) - set(string.ascii_letters.encode())))
+
+
+class CharCounts(NamedTuple):
+    non_space: int
+    french: int
+    ascii_alpha: int
+
+
+def classify(text: str) -> CharCounts:
+    """Count French and ASCII letters in a single pass (English/French validation)"""
+    if text.isascii():
+        # Fast path: pure ASCII has no French accents
+        ascii_alpha = len(text.encode("ascii").translate(None, _ASCII_NON_LETTERS))
+        return CharCounts(len(text) - text.count(" "), 0, ascii_alpha)
+    marked = text.translate(_CATEGORY_TABLE)
+    return CharCounts(
+        non_space=len(text) - text.count(" "),
+        french=marked.count(_FRENCH),
+        ascii_alpha=marked.count(_ASCII_ALPHA),
+    )
 
 
 def is_valid_transcription(text: str, source_lang: str) -> bool:
@@ -151,70 +364,122 @@ def is_valid_transcription(text: str, source_lang: str) -> bool:
     if text.strip() in ['<noise>', '<sound>', '']:
         return False
     
-    if source_lang == "ja":
-        return is_japanese(text)
-    elif source_lang == "ko":
-        return is_korean(text)
-    elif source_lang == "en":
+    script_re = SCRIPT_RE.get(source_lang)
+    if script_re is not None:
+        # Pure ASCII can never match a non-Latin script
+        if text.isascii():
+            return False
+        # Only one script matters: count its runs with the regex engine
+        non_space = len(text) - text.count(" ")
+        script_count = sum(map(len, script_re.findall(text)))
+        return non_space > 0 and script_count / non_space > 0.3
+    
+    counts = classify(text)
+    if counts.non_space == 0:
+        return False
+    
+    if source_lang == "en":
         # English: mostly ASCII letters, no French accents
-        french_chars = set('àâäéèêëïîôùûüçœæÀÂÄÉÈÊËÏÎÔÙÛÜÇŒÆ')
-        has_french = any(c in french_chars for c in text)
-        ascii_count = sum(1 for c in text if c.isascii() and c.isalpha())
-        non_space = len(text.replace(" ", ""))
-        return non_space > 0 and (ascii_count / non_space) > 0.5 and not has_french
+        return counts.ascii_alpha / counts.non_space > 0.5 and counts.french == 0
     elif source_lang == "fr":
-        return is_french(text)
+        # French: mostly Latin letters (accents optional)
+        return counts.ascii_alpha / counts.non_space > 0.5
     return True
 
 
-async def translate_text(client, source_text: str, source_lang: str, context: list) -> str:
-    """Translate text: en/jp→ko, ko→en/jp"""
-    try:
-        context_str = ""
-        if context:
-            context_str = "\n".join([f"- {p['input']} -> {p['output']}" for p in context])
-            context_str = f"Previous translations for context:\n{context_str}\n\n"
-        
-        # Set target language based on source
-        if source_lang == "ko":
-            target_lang = "English"
-            source_name = "Korean"
-        else:
-            target_lang = "Korean"
-            source_name = LANGUAGES[source_lang]["name"]
-        
-        prompt = f"""{context_str}This is real-time speech transcription. Translate the following from {source_name} to natural {target_lang}.
-Consider the context above for consistent terminology and natural flow.
-Output ONLY the {target_lang} translation, nothing else.
+def lookup_phrase(source_text: str, source_lang: str):
+    """Return a fixed translation for common short phrases, or None"""
+    key = normalize_text(source_text).strip(PHRASE_PUNCTUATION)
+    return PHRASE_TRANSLATIONS.get(source_lang, {}).get(key)
 
-{source_text}"""
 
-        response = await client.aio.models.generate_content(
-            model=TRANSLATE_MODEL,
-            contents=prompt
-        )
-        return response.text.strip()
+def pick_model(source_text: str) -> str:
+    """Route short utterances to the cheaper model tier"""
+    if len(source_text) < SHORT_TEXT_MAX_CHARS and source_text.count(" ") < 4:
+        return SHORT_TRANSLATE_MODEL
+    return TRANSLATE_MODEL
+
+
+def translation_direction(source_lang: str) -> tuple[str, str]:
+    """Return (source name, target name): en/ja/fr→ko, ko→en"""
+    if source_lang == "ko":
+        return "Korean", "English"
+    return LANGUAGES[source_lang]["name"], "Korean"
+
+
+async def translate_text(client, session: TranslatorSession, source_text: str, on_text=None) -> str:
+    """Translate text: en/jp→ko, ko→en/jp (streamed pieces go to on_text, if given)"""
+    phrase = lookup_phrase(source_text, session.source_lang)
+    if phrase is not None:
+        return phrase
+    
+    cached = session.get_cached_translation(source_text)
+    if cached is not None:
+        return cached
+    
+    try:
+        # Stream so the start of the translation can be shown before it is complete
+        pieces = []
+        async for chunk in await client.aio.models.generate_content_stream(
+            model=pick_model(source_text),
+            contents=f"{session.context_str}Text:\n{source_text}",
+            config=session.translate_config  # Static instruction: identical prefix across requests
+        ):
+            if chunk.text:
+                pieces.append(chunk.text)
+                if on_text:
+                    on_text(chunk.text)
+        translated = "".join(pieces).strip()
+        if not translated:
+            raise ValueError("empty response")  # e.g. blocked; never cache it
+        session.cache_translation(source_text, translated)
+        return translated
     except Exception as e:
         return f"[Translation error: {e}]"
 
 
-async def run_session(input_id: int, source_lang: str, session: TranslatorSession, client: genai.Client, resume_handle: str = None):
-    """Run a single Live API session with auto-resume support"""
-    audio = pyaudio.PyAudio()
-    stream = audio.open(
-        format=pyaudio.paInt16, channels=1, rate=INPUT_SAMPLE_RATE,
-        input=True, input_device_index=input_id, frames_per_buffer=CHUNK_SIZE
-    )
+async def translate_batch(client, session: TranslatorSession, source_texts: list) -> list:
+    """Translate several transcripts in one structured-output request"""
+    results = []
+    for source_text in source_texts:
+        translated = lookup_phrase(source_text, session.source_lang)
+        if translated is None:
+            translated = session.get_cached_translation(source_text)
+        results.append(translated)
     
-    queue = asyncio.Queue()
-    translation_queue = asyncio.Queue()
-    running = True
-    new_resume_handle = None  # Store new handle for reconnection
+    missing = [i for i, translated in enumerate(results) if translated is None]
+    if len(missing) > 1:
+        try:
+            items = _json_encode([{"id": i, "text": source_texts[i]} for i in missing])
+            
+            response = await client.aio.models.generate_content(
+                model=TRANSLATE_MODEL,
+                contents=f"{session.context_str}Items:\n{items}",
+                config=session.batch_config
+            )
+            translations = {item["id"]: item["translation"] for item in json.loads(response.text)}
+            for i in missing:
+                translated = translations[i].strip()
+                if translated:  # Empty items are retried one by one below
+                    results[i] = translated
+                    session.cache_translation(source_texts[i], translated)
+        except Exception:
+            pass  # Translate the rest one by one below
     
+    # Single text, or anything the batch response did not cover.
+    # One at a time: the caller holds a single slot of TRANSLATE_CONCURRENCY.
+    for i, translated in enumerate(results):
+        if translated is None:
+            results[i] = await translate_text(client, session, source_texts[i])
+    return results
+
+
+def build_live_config(source_lang: str) -> types.LiveConnectConfig:
+    """Build the Live API (STT) config for a source language"""
     # Use language-specific instruction for STT
     lang_instruction = LANGUAGES[source_lang]["instruction"]
     
-    config = types.LiveConnectConfig(
+    return types.LiveConnectConfig(
         response_modalities=["AUDIO"],
         system_instruction=f"{lang_instruction} Do not respond, just listen and transcribe.",
         input_audio_transcription=types.AudioTranscriptionConfig(),
@@ -232,77 +497,239 @@ async def run_session(input_id: int, source_lang: str, session: TranslatorSessio
             sliding_window=types.SlidingWindow(),
         ),
         # Enable session resumption for reconnection
-        session_resumption=types.SessionResumptionConfig(
-            handle=resume_handle  # Pass previous handle or None for new session
-        ),
+        session_resumption=types.SessionResumptionConfig(),
     )
+
+
+# Built once at import; reused on every reconnect
+LIVE_CONFIGS = {lang: build_live_config(lang) for lang in LANGUAGES}
+
+
+def chunk_rms(data: bytes) -> float:
+    """RMS level of a 16-bit PCM chunk"""
+    samples = np.frombuffer(data, dtype=np.int16)
+    return float(np.sqrt(np.mean(np.square(samples, dtype=np.float32)))) if samples.size else 0.0
+
+
+class ConsoleOutput:
+    """Streams transcript and translation text to stdout, each starting on its own line"""
     
-    async def capture():
-        """Capture audio from microphone and send to queue"""
-        nonlocal running
-        while running:
-            try:
-                data = await asyncio.to_thread(stream.read, CHUNK_SIZE, exception_on_overflow=False)
-                await queue.put(data)
-            except Exception:
-                break
+    def __init__(self):
+        self._open = None  # Stream whose line is unfinished ("transcript" or "translation")
+    
+    def write(self, stream: str, text: str):
+        if self._open != stream:
+            if self._open is not None:
+                print()  # Finish the other stream's line first
+            text = text.lstrip()
+        print(text, end="", flush=True)
+        self._open = stream
+    
+    def end_line(self, stream: str, blank: bool = False):
+        """Finish the stream's line if it is open (blank adds an empty line after it)"""
+        if self._open == stream:
+            print("\n" if blank else "")
+            self._open = None
+
+
+console = ConsoleOutput()
+
+
+class AudioBuffer:
+    """Captured frames handed from the PortAudio thread to the event loop"""
+    
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        # append/popleft are atomic under the GIL; the oldest frames drop during long reconnects
+        self._frames = deque(maxlen=int(AUDIO_BACKLOG_SEC * INPUT_SAMPLE_RATE / CHUNK_SIZE))
+        self._ready = asyncio.Event()
+    
+    def put(self, data: bytes):
+        """Add a frame (PortAudio thread); wakes the loop only if it is not already woken"""
+        self._frames.append(data)
+        if not self._ready.is_set():
+            self._loop.call_soon_threadsafe(self._ready.set)
+    
+    async def wait(self):
+        """Wait until frames are pending"""
+        await self._ready.wait()
+    
+    def drain(self, max_frames: int) -> bytes:
+        """Take up to max_frames pending frames as one buffer"""
+        self._ready.clear()
+        chunks = []
+        while self._frames and len(chunks) < max_frames:
+            chunks.append(self._frames.popleft())
+        if self._frames:
+            self._ready.set()  # Rest goes out with the next blob
+        return b"".join(chunks)
+
+
+def open_input_stream(audio: pyaudio.PyAudio, input_id: int, buffer: AudioBuffer):
+    """Open a callback-mode mic stream that feeds captured frames into buffer"""
+    hangover_chunks = int(SILENCE_HANGOVER_SEC * INPUT_SAMPLE_RATE / CHUNK_SIZE)
+    preroll = deque(maxlen=SILENCE_PREROLL_CHUNKS)
+    silent_chunks = 0
+    
+    def on_audio(in_data, frame_count, time_info, status):
+        """PortAudio callback: hand captured frames to the event loop"""
+        nonlocal silent_chunks
+        if SKIP_SILENCE:
+            silent_chunks = silent_chunks + 1 if chunk_rms(in_data) < SILENCE_RMS else 0
+            if silent_chunks > hangover_chunks:
+                preroll.append(in_data)  # Held back, sent if speech resumes
+                return (None, pyaudio.paContinue)
+            while preroll:
+                buffer.put(preroll.popleft())
+        buffer.put(in_data)
+        return (None, pyaudio.paContinue)
+    
+    return audio.open(
+        format=pyaudio.paInt16, channels=1, rate=INPUT_SAMPLE_RATE,
+        input=True, input_device_index=input_id, frames_per_buffer=CHUNK_SIZE,
+        stream_callback=on_audio
+    )
+
+
+async def run_session(audio: AudioBuffer, session: TranslatorSession, client: genai.Client):
+    """Run a single Live API session with auto-resume support"""
+    source_lang = session.source_lang
+    loop = asyncio.get_running_loop()
+    translation_queue = asyncio.Queue()
+    pending_translations = asyncio.Queue()  # (source_texts, task, pieces) in input order
+    translate_tasks = set()  # In-flight requests, referenced until done
+    translate_slots = asyncio.Semaphore(TRANSLATE_CONCURRENCY)
+    resume_handle = session.resume_handle
+    got_message = False  # Any server message received on this connection
+    
+    # Prebuilt per-language config; only the resumption handle changes
+    config = LIVE_CONFIGS[source_lang].model_copy(update={
+        "session_resumption": types.SessionResumptionConfig(
+            handle=resume_handle  # Pass previous handle or None for new session
+        ),
+    })
     
     async def send(session_api):
-        nonlocal running
-        while running:
+        """Send captured audio as it arrives, chunks pending together in one blob (runs until cancelled)"""
+        while True:
             try:
-                data = await asyncio.wait_for(queue.get(), timeout=0.1)
+                await audio.wait()
+                data = audio.drain(SEND_MAX_CHUNKS)
+                if not data:
+                    continue
                 await session_api.send_realtime_input(
-                    audio=types.Blob(data=data, mime_type=f"audio/pcm;rate={INPUT_SAMPLE_RATE}"))
-            except asyncio.TimeoutError:
-                continue
-            except Exception:
+                    audio=types.Blob(data=data, mime_type=AUDIO_MIME))
+            except Exception as e:
+                print(f"\n[send error: {e}]")
                 break
     
+    def should_translate(source_text: str) -> bool:
+        # Fixed phrases ("Yes.", "네") are answered without an API call, whatever their length
+        if lookup_phrase(source_text, source_lang) is not None:
+            return True
+        # Skip too-short chunks (often produce bad translations)
+        if len(source_text.strip()) < MIN_CHUNK_LENGTH:
+            return False
+        # Skip one-word stubs ("Yeah.")
+        # (Japanese is written without spaces, so word counts do not apply)
+        if source_lang != "ja" and len(source_text.split()) < MIN_CHUNK_WORDS:
+            return False
+        # Skip if text doesn't match source language (filter noise/other languages)
+        return is_valid_transcription(source_text, source_lang)
+    
+    async def translate_in_slot(source_texts: list, pieces: asyncio.Queue = None) -> list:
+        try:
+            if pieces is None:
+                return await translate_batch(client, session, source_texts)
+            return [await translate_text(client, session, source_texts[0], on_text=pieces.put_nowait)]
+        finally:
+            if pieces is not None:
+                pieces.put_nowait(None)  # End of stream
+            translate_slots.release()
+    
     async def translator():
-        """Background task that translates queued text"""
-        nonlocal running
-        while running:
+        """Background task that dispatches queued text for concurrent translation"""
+        done = False
+        while not done:
             try:
-                source_text = await asyncio.wait_for(translation_queue.get(), timeout=0.1)
-                
-                # Skip too-short chunks (often produce bad translations)
-                if len(source_text.strip()) < MIN_CHUNK_LENGTH:
-                    continue
-                
-                # Skip if text doesn't match source language (filter noise/other languages)
-                if not is_valid_transcription(source_text, source_lang):
-                    continue
+                items = [await translation_queue.get()]
+                if items[0] is not SHUTDOWN:
+                    # Wait for a free slot; text queued meanwhile joins this batch
+                    await translate_slots.acquire()
+                    while len(items) < TRANSLATE_BATCH_MAX and not translation_queue.empty():
+                        items.append(translation_queue.get_nowait())
                 
-                translated = await translate_text(client, source_text, source_lang, session.get_context(n=5))
-                
-                # Show translation below the streamed input
-                print(f"{translated}\n")
+                batch = []
+                for source_text in items:
+                    if source_text is SHUTDOWN:
+                        done = True
+                        break
+                    if should_translate(source_text):
+                        batch.append(source_text)
                 
-                session.add_pair(source_text, translated)
-            except asyncio.TimeoutError:
-                continue
+                if batch:
+                    # A single text is streamed; batches arrive as one response
+                    pieces = asyncio.Queue() if len(batch) == 1 else None
+                    task = asyncio.create_task(translate_in_slot(batch, pieces))
+                    translate_tasks.add(task)
+                    task.add_done_callback(translate_tasks.discard)
+                    await pending_translations.put((batch, task, pieces))
+                elif items[0] is not SHUTDOWN:
+                    translate_slots.release()
+            except Exception as e:
+                print(f"\n[translator error: {e}]")
+        await pending_translations.put(SHUTDOWN)
+    
+    async def printer():
+        """Background task that outputs translations in input order"""
+        while True:
+            try:
+                item = await pending_translations.get()
+                if item is SHUTDOWN:
+                    break
+                source_texts, task, pieces = item
+                # Show translation below the streamed input, as it arrives
+                streamed = []
+                while pieces is not None and (piece := await pieces.get()) is not None:
+                    console.write("translation", piece)
+                    streamed.append(piece)
+                for source_text, translated in zip(source_texts, await task):
+                    if "".join(streamed).strip() != translated:
+                        console.end_line("translation")
+                        console.write("translation", translated)
+                    console.end_line("translation", blank=True)
+                    
+                    session.add_pair(source_text, translated)
             except Exception as e:
                 print(f"\n[translator error: {e}]")
     
     async def receive(session_api):
-        """Receive transcription and flush buffer on time OR sentence end"""
-        nonlocal running, new_resume_handle
-        current_buffer = ""
-        last_chunk_time = time.time()
+        """Receive transcription and flush buffer on time OR sentence end (stopped by cancellation)"""
+        nonlocal got_message
+        buffer_parts = []       # Streamed chunks, joined only on flush
+        has_text = False        # Buffer has non-whitespace content
+        sentence_ended = False  # Last non-whitespace chunk ends a sentence
+        last_chunk_time = loop.time()
         
-        while running:
+        async def flush_buffer():
+            nonlocal buffer_parts, has_text, sentence_ended
+            if has_text:
+                await translation_queue.put("".join(buffer_parts).strip())
+            buffer_parts = []
+            has_text = sentence_ended = False
+        
+        while True:
             try:
                 turn = session_api.receive()
                 async for resp in turn:
-                    if not running:
-                        break
+                    got_message = True
                     
                     # Handle session resumption updates
                     if resp.session_resumption_update:
                         update = resp.session_resumption_update
                         if update.resumable and update.new_handle:
-                            new_resume_handle = update.new_handle
+                            # Stored on the session so it survives a timeout or error
+                            session.resume_handle = update.new_handle
                     
                     # Handle GoAway message (connection about to close)
                     if resp.go_away is not None:
@@ -313,56 +740,50 @@ async def run_session(input_id: int, source_lang: str, session: TranslatorSessio
                         continue
                     
                     if sc.interrupted:
-                        if current_buffer.strip():
-                            print()  # New line after interrupted input
-                            await translation_queue.put(current_buffer.strip())  # Translate interrupted speech too
-                        current_buffer = ""
-                        last_chunk_time = time.time()
+                        console.end_line("transcript")  # New line after interrupted input
+                        await flush_buffer()  # Translate interrupted speech too
+                        last_chunk_time = loop.time()
                         continue
                     
                     # Stream input transcription in real-time
+                    # (language filtering runs once per flushed buffer in translator)
                     if sc.input_transcription and sc.input_transcription.text:
                         chunk = sc.input_transcription.text
-                        # Filter: only add to buffer if source language detected
-                        if is_valid_transcription(chunk, source_lang) or chunk.strip() in ['<noise>', '<sound>', '']:
-                            current_buffer += chunk
-                            print(chunk, end="", flush=True)  # Real-time streaming
-                        # Skip non-source-language chunks silently
-                    
-                    elapsed = time.time() - last_chunk_time
+                        buffer_parts.append(chunk)
+                        if not chunk.isspace():
+                            has_text = True
+                            sentence_ended = ends_with_sentence(chunk)
+                        console.write("transcript", chunk)  # Real-time streaming
                     
                     # Flush conditions:
                     # 1. Time limit reached (10 sec) AND buffer has content
-                    # 2. Sentence ended AND minimum 3 seconds passed (avoid too frequent)
+                    # 2. Sentence ended AND minimum wait passed (avoid too frequent)
                     should_flush = False
                     
-                    if current_buffer.strip():
+                    if has_text:
+                        elapsed = loop.time() - last_chunk_time
                         if elapsed >= CHUNK_DURATION_SEC:
                             should_flush = True
-                        elif elapsed >= 1.0 and ends_with_sentence(current_buffer):
+                        elif elapsed >= SENTENCE_FLUSH_MIN and sentence_ended:
                             should_flush = True
                     
                     if should_flush:
-                        print()  # New line after completed input
-                        await translation_queue.put(current_buffer.strip())
-                        current_buffer = ""
-                        last_chunk_time = time.time()
+                        console.end_line("transcript")  # New line after completed input
+                        await flush_buffer()
+                        last_chunk_time = loop.time()
                         
+            except asyncio.CancelledError:
+                await flush_buffer()  # Session timeout: still translate buffered speech
+                raise
             except Exception as e:
-                if running:
-                    print(f"\n[receive error: {e}]")
-                    # Flush remaining buffer before raising
-                    if current_buffer.strip():
-                        await translation_queue.put(current_buffer.strip())
-                    raise  # Re-raise to trigger reconnection
-                break
-        
-        # Flush remaining buffer (normal exit)
-        if current_buffer.strip():
-            await translation_queue.put(current_buffer.strip())
+                print(f"\n[receive error: {e}]")
+                # Flush remaining buffer before raising
+                await flush_buffer()
+                raise  # Re-raise to trigger reconnection
     
-    capture_task = asyncio.create_task(capture())
     translator_task = asyncio.create_task(translator())
+    printer_task = asyncio.create_task(printer())
+    send_task = None
     session_error = None  # Store error to re-raise after cleanup
     
     try:
@@ -371,55 +792,65 @@ async def run_session(input_id: int, source_lang: str, session: TranslatorSessio
             print(f"{status}!")
             send_task = asyncio.create_task(send(session_api))
             await receive(session_api)
-            send_task.cancel()
                     
     except (KeyboardInterrupt, asyncio.CancelledError):
         raise
     except Exception as e:
         session_error = e  # Store error to re-raise
         print(f"\n[Session error: {e}]")
+        if resume_handle and not got_message:
+            # The handle may have expired: start a fresh session on the next attempt
+            session.resume_handle = None
     finally:
-        running = False
-        capture_task.cancel()
-        translator_task.cancel()
-        
-        # Wait for pending translations
-        await asyncio.sleep(0.5)
+        if send_task:
+            # Make sure the old sender has stopped before the next session drains audio
+            send_task.cancel()
+            await asyncio.gather(send_task, return_exceptions=True)
+        translation_queue.put_nowait(SHUTDOWN)
         
-        stream.stop_stream()
-        stream.close()
-        audio.terminate()
+        # Both tasks exit once everything queued before SHUTDOWN is printed
+        _, unfinished = await asyncio.wait({translator_task, printer_task}, timeout=TRANSLATION_DRAIN_SEC)
+        unfinished |= translate_tasks  # Requests the printer never got to
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
     
     # Re-raise exception after cleanup so run_translator can reconnect
     if session_error:
         raise session_error
-    
-    return new_resume_handle  # Return handle for next session
 
 
-async def run_translator(input_id: int, source_lang: str):
-    """Run translator with auto-reconnect using session resumption"""
-    session = TranslatorSession()
+async def prewarm_client() -> genai.Client:
+    """Create the API client and open its connection ahead of the first request"""
     client = genai.Client()
-    resume_handle = None  # Store session handle for reconnection
+    try:
+        await client.aio.models.get(model=TRANSLATE_MODEL)
+    except Exception:
+        pass  # Best effort; the first translation connects if this fails
+    return client
+
+
+async def run_translator(input_id: int, source_lang: str, client: genai.Client):
+    """Run translator with auto-reconnect using session resumption"""
+    # Audio stays open across reconnects; only the Live API session restarts.
+    # Opened first so a failing device leaves no history writer behind.
+    audio = AudioBuffer()
+    stream = open_input_stream(get_pyaudio(), input_id, audio)
+    
+    session = TranslatorSession(source_lang)
+    session.start()
     
     # Show translation direction
-    if source_lang == "ko":
-        direction = "Korean → English"
-    else:
-        direction = f"{LANGUAGES[source_lang]['name']} → Korean"
-    print(f"\nTranslation: {direction}")
+    print(f"\nTranslation: {session.source_name} → {session.target_name}")
     
     try:
         while True:
             try:
-                new_handle = await asyncio.wait_for(
-                    run_session(input_id, source_lang, session, client, resume_handle),
+                # Capture keeps buffering audio while a new session connects
+                await asyncio.wait_for(
+                    run_session(audio, session, client),
                     timeout=SESSION_TIMEOUT
                 )
-                # Update handle for next reconnection
-                if new_handle:
-                    resume_handle = new_handle
                 break  # Normal exit
             except asyncio.TimeoutError:
                 print(f"\n[Timeout - auto-reconnecting...]")
@@ -433,6 +864,9 @@ async def run_translator(input_id: int, source_lang: str):
                 await asyncio.sleep(2)  # Brief delay before reconnecting
                 continue
     finally:
+        stream.stop_stream()
+        stream.close()
+        await session.close()
         print(f"\nSession saved: {session.filepath}")
         print(f"[{session.chunk_count} chunks translated]")
 
@@ -446,9 +880,12 @@ async def main():
     print("Live Translator")
     print("=" * 40)
     
-    input_id = select_device(devices)
-    source_lang = select_language()
-    await run_translator(input_id, source_lang)
+    # Connect in the background while the user picks device and language
+    prewarm_task = asyncio.create_task(prewarm_client())
+    input_id = await run_prompt(select_device, devices)
+    source_lang = await run_prompt(select_language)
+    client = await prewarm_task
+    await run_translator(input_id, source_lang, client)
 
 
 if __name__ == "__main__":